@@ -1,4 +1,5 @@
 import sys
+from multiprocessing import freeze_support
 from shutil import which
 
 from PyQt6.QtWidgets import QApplication, QMessageBox, QStyleFactory
@@ -6,6 +7,8 @@ from PyQt6.QtWidgets import QApplication, QMessageBox, QStyleFactory
 from footgas import Footgas
 
 if __name__ == '__main__':
+    # the library indexes recordings in a process pool
+    freeze_support()
     app = QApplication(sys.argv)
     styles = QStyleFactory.keys()
     if 'Fusion' in styles:
@@ -1,15 +1,25 @@
+import os
+import tempfile
+
 from PyQt6.QtCore import Qt, QThread, QUrl
-from PyQt6.QtWidgets import QHBoxLayout, QProgressBar, QVBoxLayout, QWidget
+from PyQt6.QtWidgets import (QHBoxLayout, QMessageBox, QProgressBar, QSplitter,
+                             QVBoxLayout, QWidget)
 from superqt import QRangeSlider
 
-from .util import ftime
+from .scene_index import SceneDetectWorker, SceneIndex
+from .util import cache_dir, ftime
 from .widgets.footgas_options import FootgasOptionsWidget
+from .widgets.library_browser import LibraryBrowserWidget
 from .widgets.video_player import VideoPlayerWidget
-from .worker import SaveWorker
+from .worker import PreviewWorker, SaveWorker
 
 
 class Footgas(QWidget):
     APP_TITLE = 'footgas{ext}'
+    # how close (ms) a clip boundary must be to a scene cut to snap to it
+    SCENE_SNAP_MS = 500
+    # length (ms) of the part of the clip rendered by preview
+    PREVIEW_LENGTH_MS = 10000
 
     def __init__(self):
         super().__init__()
@@ -17,6 +27,11 @@ class Footgas(QWidget):
         self.source_file = ''
         self.clip_start = 0
         self.clip_end = 0
+        self.scene_index = SceneIndex()
+        self.scene_worker = None
+        self.scene_t = None
+        self.w_preview = None
+        self.preview_file = None
 
         self.setWindowTitle(self.APP_TITLE.format(ext=''))
         self.populate()
@@ -39,8 +54,14 @@ class Footgas(QWidget):
         self.w_options = FootgasOptionsWidget()
         self.w_options.sourceSelected.connect(self._set_source)
         self.w_options.save.connect(self._save)
-        self.w_options.overrideStartChanged.connect(self._set_clip_start)
-        self.w_options.overrideEndChanged.connect(self._set_clip_end)
+        self.w_options.preview.connect(self._preview)
+        # typed times are taken as is, the text fields can't show a snapped time
+        self.w_options.overrideStartChanged.connect(
+            lambda start: self._set_clip_start(start, snap=False)
+        )
+        self.w_options.overrideEndChanged.connect(
+            lambda end: self._set_clip_end(end, snap=False)
+        )
         self.w_options.startNowClicked.connect(self._set_clip_start)
         self.w_options.endNowClicked.connect(self._set_clip_end)
         self.w_options.setEnabled(False)
@@ -68,20 +89,37 @@ class Footgas(QWidget):
         progress_widget = QWidget()
         progress_widget.setLayout(layout)
 
+        # Recording library
+        self.w_library = LibraryBrowserWidget()
+        self.w_library.sourceSelected.connect(self._set_source)
+
         vbox = QVBoxLayout()
         vbox.addWidget(self.w_video_player, stretch=1)
         vbox.addWidget(clip_range_widget)
         vbox.addWidget(self.w_options)
         vbox.addWidget(progress_widget)
+        vbox.setContentsMargins(0, 0, 0, 0)
+        editor_widget = QWidget()
+        editor_widget.setLayout(vbox)
+
+        splitter = QSplitter(Qt.Orientation.Horizontal)
+        splitter.addWidget(self.w_library)
+        splitter.addWidget(editor_widget)
+        splitter.setStretchFactor(1, 1)
+
+        layout = QHBoxLayout()
+        layout.addWidget(splitter)
 
-        self.setLayout(vbox)
+        self.setLayout(layout)
 
-    def _set_clip_start(self, start: int = -1):
+    def _set_clip_start(self, start: int = -1, snap: bool = True):
         '''
         Set the start time of the clip
         '''
         if start == -1:
             start = self.w_video_player.position()
+        if snap:
+            start = self._snap(start)
         self.clip_start = start
         self.w_video_player.setRange(self.clip_start, self.clip_end)
         self.w_options.setStart(start)
@@ -90,20 +128,28 @@ class Footgas(QWidget):
         # When changing the clip start position, always restart the clip
         self.w_video_player.setPosition(self.clip_start)
 
-    def _set_clip_end(self, end: int = -1):
+    def _set_clip_end(self, end: int = -1, snap: bool = True):
         '''
         Set the end time of the clip
         '''
         if end == -1:
             end = self.w_video_player.position()
+        if snap:
+            end = self._snap(end)
         self.clip_end = end
         self.w_video_player.setRange(self.clip_start, self.clip_end)
         self.w_options.setEnd(end)
         self.w_clip_range.setValue((self.clip_start, end))
 
+    def _snap(self, time: int) -> int:
+        if not self.w_options.snapToScenes():
+            return time
+        return self.scene_index.snap(time, self.SCENE_SNAP_MS)
+
     def _set_source(self, filename: str):
         self.source_file = filename
         self.setWindowTitle(self.APP_TITLE.format(ext=f' - {filename}'))
+        self._index_scenes(filename)
 
         url = QUrl.fromLocalFile(filename)
         self.w_video_player.setSource(url)
@@ -130,6 +176,130 @@ class Footgas(QWidget):
         self.w_clip_range.setRange(0, duration)
         self.w_clip_range.setValue((0, duration))
 
+    def _index_scenes(self, filename: str):
+        '''
+        Build or load the scene index of the source in the background
+        '''
+        self._stop_scene_index()
+        self.scene_index = SceneIndex()
+
+        self.scene_t = QThread()
+        self.scene_worker = SceneDetectWorker(filename)
+        self.scene_worker.moveToThread(self.scene_t)
+
+        self.scene_t.started.connect(self.scene_worker.detect)
+        self.scene_worker.done.connect(self.scene_worker.deleteLater)
+        self.scene_worker.done.connect(self.scene_t.quit)
+        self.scene_worker.indexed.connect(self._scenes_indexed)
+
+        self.scene_t.start()
+        self.scene_t.setPriority(QThread.Priority.LowPriority)
+
+    def _stop_scene_index(self):
+        if self.scene_worker is None:
+            return
+        self.scene_worker.stop()
+        # the thread must be finished before it can be let go of
+        self.scene_t.quit()
+        self.scene_t.wait()
+        self.scene_worker = None
+        self.scene_t = None
+
+    def _scenes_indexed(self, index: SceneIndex):
+        # ignore indexes of sources that have since been replaced
+        if self.scene_worker is None or self.sender() is not self.scene_worker:
+            return
+        self.scene_index = index
+
+    def _preview(self):
+        start, end = self.w_clip_range.value()
+
+        # preview a window around the playhead, or the whole clip if it's short
+        pos = min(end, max(start, self.w_video_player.position()))
+        preview_start = max(start, pos - self.PREVIEW_LENGTH_MS // 2)
+        preview_end = min(end, preview_start + self.PREVIEW_LENGTH_MS)
+        preview_start = max(start, preview_end - self.PREVIEW_LENGTH_MS)
+
+        fd, out_fn = tempfile.mkstemp(suffix='.mp4', dir=cache_dir('previews'))
+        os.close(fd)
+
+        self.w_clip_range.setEnabled(False)
+        self.w_options.setEnabled(False)
+
+        self.preview_t = QThread()
+        self.preview_worker = PreviewWorker(
+            file=self.source_file,
+            out_fn=out_fn,
+            start=ftime(start),
+            end=ftime(end),
+            max_size_mb=self.w_options.maxFileSize(),
+            resolution=self.w_options.resolution(),
+            fps=self.w_options.fps(),
+            audio_bitrate_kb=self.w_options.audioBitrate(),
+            preview_start=ftime(preview_start),
+            preview_end=ftime(preview_end),
+        )
+        self.preview_worker.moveToThread(self.preview_t)
+
+        self.preview_t.started.connect(self.preview_worker.render_preview)
+        self.preview_worker.done.connect(self.preview_worker.deleteLater)
+        self.preview_worker.done.connect(self.preview_t.quit)
+        self.preview_worker.done.connect(self.preview_t.deleteLater)
+
+        self.preview_worker.progress.connect(
+            lambda p: self.w_progress.setValue(p)
+        )
+        self.preview_worker.rendered.connect(self._show_preview)
+        self.preview_worker.done.connect(
+            lambda: (
+                self.w_clip_range.setEnabled(True),
+                self.w_options.setEnabled(True)
+            )
+        )
+
+        self.preview_t.start()
+
+    def _show_preview(self, filename: str):
+        if self.w_preview is None:
+            # previews are throwaway, don't decode frames for stepping through them
+            self.w_preview = VideoPlayerWidget(frame_stepping=False)
+            self.w_preview.setWindowTitle(self.APP_TITLE.format(ext=' - preview'))
+            self.w_preview.resize(self.w_video_player.size())
+
+        self.w_preview.setSource(QUrl.fromLocalFile(filename))
+        self.w_preview.show()
+        self.w_preview.play()
+
+        # the previous preview is no longer needed
+        self._remove_preview_file()
+        self.preview_file = filename
+
+    def _remove_preview_file(self):
+        if self.preview_file is None:
+            return
+        try:
+            os.remove(self.preview_file)
+        except OSError:
+            pass
+        self.preview_file = None
+
+    def closeEvent(self, event):
+        self.w_video_player.stopFrameDecoder()
+        self.w_library.stopIndexing()
+        self._stop_scene_index()
+        if self.w_preview is not None:
+            self.w_preview.setSource(QUrl())
+            self.w_preview.close()
+            self._remove_preview_file()
+        super().closeEvent(event)
+
+    def _save_warning(self, message: str):
+        warning_popup = QMessageBox()
+        warning_popup.setWindowTitle('Warning')
+        warning_popup.setIcon(QMessageBox.Icon.Warning)
+        warning_popup.setText(message)
+        warning_popup.exec()
+
     def _save(self, filename: str):
         start, end = map(ftime, self.w_clip_range.value())
 
@@ -146,6 +316,8 @@ class Footgas(QWidget):
             resolution=self.w_options.resolution(),
             fps=self.w_options.fps(),
             audio_bitrate_kb=self.w_options.audioBitrate(),
+            fragmented=self.w_options.fragmented(),
+            incremental=self.w_options.incremental(),
         )
         self.save_worker.moveToThread(self.save_t)
 
@@ -157,6 +329,7 @@ class Footgas(QWidget):
         self.save_worker.progress.connect(
             lambda p: self.w_progress.setValue(p)
         )
+        self.save_worker.warning.connect(self._save_warning)
         self.save_worker.done.connect(
             lambda: (
                 self.w_clip_range.setEnabled(True),
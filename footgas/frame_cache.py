@@ -0,0 +1,201 @@
+import subprocess
+import threading
+
+from PyQt6.QtCore import QObject, pyqtSignal
+from PyQt6.QtGui import QImage
+
+from .util import NO_WINDOW_FLAG
+
+
+class FrameRingCache:
+    '''
+    Bounded cache of decoded frames around the playhead.
+    When full, frames outside the window kept around the playhead are evicted
+    first, then the frames furthest from the playhead
+    '''
+    # share of the budget spent on frames in the direction of travel
+    PREFETCH_SHARE = 0.75
+    # share of the frames ahead left when the next chunk should be fetched
+    LOW_WATER_SHARE = 0.25
+
+    def __init__(self, max_frames: int = 120, frame_count: int = 0) -> None:
+        self.max_frames = max(1, max_frames)
+        self.frame_count = frame_count
+        self.playhead = 0
+        self.direction = 1
+        self.frames = {}
+
+    def __contains__(self, index: int) -> bool:
+        return index in self.frames
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def get(self, index: int):
+        return self.frames.get(index)
+
+    def put(self, index: int, frame) -> None:
+        self.frames[index] = frame
+        if len(self.frames) <= self.max_frames:
+            return
+
+        lo, hi = self.window(self.playhead, self.direction)
+        while len(self.frames) > self.max_frames:
+            outside = [i for i in self.frames if not lo <= i <= hi]
+            furthest = max(outside or self.frames, key=lambda i: abs(i - self.playhead))
+            del self.frames[furthest]
+
+    def clear(self) -> None:
+        self.frames.clear()
+
+    def setPlayhead(self, index: int, direction: int = 0) -> None:
+        self.playhead = index
+        if direction:
+            self.direction = 1 if direction > 0 else -1
+
+    def needsPrefetch(self) -> bool:
+        '''
+        Whether the frames cached ahead of the playhead are running low
+        '''
+        lo, hi = self.window(self.playhead, self.direction)
+        end = hi if self.direction > 0 else lo
+        ahead = 0
+        index = self.playhead + self.direction
+        while index in self.frames:
+            ahead += 1
+            index += self.direction
+        return ahead < int(abs(end - self.playhead) * self.LOW_WATER_SHARE) or \
+            self.playhead not in self.frames
+
+    def window(self, index: int, direction: int) -> tuple[int, int]:
+        '''
+        Range of frames (inclusive) that should be kept around a frame,
+        biased towards the direction of travel
+        '''
+        ahead = int((self.max_frames - 1) * self.PREFETCH_SHARE)
+        behind = self.max_frames - 1 - ahead
+        if direction < 0:
+            ahead, behind = behind, ahead
+
+        lo = max(0, index - behind)
+        hi = index + ahead
+        if self.frame_count:
+            hi = min(self.frame_count - 1, hi)
+        return lo, hi
+
+    def missing(self, lo: int, hi: int) -> tuple[int, int]:
+        '''
+        Smallest range (inclusive) covering every uncached frame in lo-hi,
+        or None if everything is cached
+        '''
+        missing = [i for i in range(lo, hi + 1) if i not in self.frames]
+        if not missing:
+            return None
+        return missing[0], missing[-1]
+
+
+class FrameDecoder(QObject):
+    '''
+    Decodes display-sized frames in the background on request
+    '''
+    frameDecoded = pyqtSignal(int, QImage)
+    done = pyqtSignal()
+
+    def __init__(
+            self,
+            file: str,
+            fps: float,
+            width: int,
+            height: int,
+            parent=None,
+    ) -> None:
+        super().__init__(parent)
+        self.file = file
+        self.fps = fps
+        self.width = width
+        self.height = height
+
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = False
+        self.pending = None
+        # span currently being decoded and the next frame it will produce
+        self.current = None
+        self.process = None
+
+    def request(self, lo: int, hi: int) -> None:
+        '''
+        Ask for frames lo-hi (inclusive) to be decoded.
+        Supersedes any earlier request not covering the same frames
+        '''
+        with self.lock:
+            if self.current is not None:
+                next_index, current_hi = self.current
+                if next_index <= lo and hi <= current_hi:
+                    return
+            self.pending = (lo, hi)
+            self.wake.set()
+
+    def stop(self) -> None:
+        with self.lock:
+            self.stopped = True
+            self.wake.set()
+            if self.process is not None:
+                self.process.kill()
+
+    def run(self):
+        while True:
+            self.wake.wait()
+            with self.lock:
+                if self.stopped:
+                    break
+                self.wake.clear()
+                span = self.pending
+                self.pending = None
+
+            if span is not None:
+                self._decode(*span)
+
+        self.done.emit()
+
+    def _decode(self, lo: int, hi: int):
+        frame_size = self.width * self.height * 3
+        with self.lock:
+            if self.stopped:
+                return
+            self.current = (lo, hi)
+            self.process = subprocess.Popen([
+                'ffmpeg', '-hide_banner', '-loglevel', 'error',
+                '-ss', f'{lo / self.fps}',
+                '-i', f'{self.file}',
+                '-an', '-sn',
+                '-frames:v', f'{hi - lo + 1}',
+                '-vf', f'scale={self.width}:{self.height}',
+                '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+                'pipe:1',
+            ], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, creationflags=NO_WINDOW_FLAG)
+
+        index = lo
+        while index <= hi:
+            data = self.process.stdout.read(frame_size)
+            if len(data) < frame_size:
+                break
+
+            image = QImage(
+                data, self.width, self.height,
+                self.width * 3, QImage.Format.Format_RGB888,
+            ).copy()
+            self.frameDecoded.emit(index, image)
+            index += 1
+
+            with self.lock:
+                self.current = (index, hi)
+                # a newer request wants other frames, drop this one
+                if self.pending is not None or self.stopped:
+                    break
+
+        with self.lock:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+            self.current = None
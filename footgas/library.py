@@ -0,0 +1,215 @@
+import os
+import sqlite3
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from PyQt6.QtCore import QObject, pyqtSignal
+
+from .util import NO_WINDOW_FLAG, cache_dir, ffprobe, frame_rate
+
+VIDEO_EXTENSIONS = ('.mp4', '.mkv', '.mov', '.avi', '.webm', '.flv', '.ts', '.m4v')
+
+
+def describe_streams(probe: dict) -> str:
+    '''
+    Short human readable summary of the streams in an ffprobe result
+    '''
+    streams = []
+    for stream in probe.get('streams', []):
+        desc = stream.get('codec_name', '?')
+        if stream.get('codec_type') == 'video':
+            desc += f' {stream.get("width")}x{stream.get("height")}'
+            fps = frame_rate(stream)
+            if fps:
+                desc += f' {round(fps)}fps'
+        streams.append(desc)
+    return ', '.join(streams)
+
+
+def index_file(path: str) -> dict:
+    '''
+    Probes a recording and grabs a poster thumbnail.
+    Runs in a worker process, so this must stay free of Qt
+    '''
+    probe = ffprobe(path)
+    duration = float(probe.get('format', {}).get('duration', 0))
+
+    poster = subprocess.run([
+        'ffmpeg', '-hide_banner', '-loglevel', 'error',
+        '-ss', f'{duration / 3}',
+        '-i', f'{path}',
+        '-frames:v', '1',
+        '-vf', f'scale={Library.POSTER_WIDTH}:-2',
+        '-f', 'image2pipe', '-c:v', 'mjpeg',
+        'pipe:1',
+    ], capture_output=True, creationflags=NO_WINDOW_FLAG).stdout
+
+    return {
+        'path': path,
+        'duration': duration,
+        'streams': describe_streams(probe),
+        'poster': poster or None,
+    }
+
+
+class Library:
+    '''
+    SQLite index of recordings in folders
+    '''
+    POSTER_WIDTH = 160
+
+    def __init__(self, db_file: str = None) -> None:
+        if db_file is None:
+            db_file = os.path.join(cache_dir('library'), 'library.sqlite3')
+        self.db_file = db_file
+
+        self.db = sqlite3.connect(db_file)
+        # lets the index be read while it's being written from another thread
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                folder TEXT NOT NULL,
+                name TEXT NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                duration REAL,
+                streams TEXT,
+                poster BLOB
+            );
+            CREATE INDEX IF NOT EXISTS files_folder_name ON files (folder, name);
+        ''')
+        self.db.commit()
+
+    def close(self) -> None:
+        self.db.close()
+
+    def stale(self, folder: str) -> list:
+        '''
+        Syncs the folder's file listing with the index.
+        Returns (path, mtime_ns, size) of files which need to be (re)indexed
+        '''
+        folder = os.path.abspath(folder)
+        indexed = dict(
+            (path, (mtime_ns, size)) for path, mtime_ns, size in self.db.execute(
+                'SELECT path, mtime_ns, size FROM files WHERE folder = ?', (folder,)
+            )
+        )
+
+        stale = []
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if not entry.is_file() or not entry.name.lower().endswith(VIDEO_EXTENSIONS):
+                    continue
+                stat = entry.stat()
+                if indexed.pop(entry.path, None) != (stat.st_mtime_ns, stat.st_size):
+                    stale.append((entry.path, stat.st_mtime_ns, stat.st_size))
+
+        # whatever is left has been removed from the folder
+        self.db.executemany('DELETE FROM files WHERE path = ?', ((path,) for path in indexed))
+        self.db.commit()
+        return stale
+
+    def add(self, info: dict, mtime_ns: int, size: int) -> None:
+        path = info['path']
+        self.db.execute(
+            'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (
+                path, os.path.dirname(path), os.path.basename(path),
+                mtime_ns, size, info['duration'], info['streams'], info['poster'],
+            ),
+        )
+
+    def commit(self) -> None:
+        self.db.commit()
+
+    def query(self, folder: str, text: str = '') -> list:
+        '''
+        Returns (path, name, duration, size, streams) of indexed files in a folder,
+        optionally filtered by name or streams
+        '''
+        pattern = f'%{text}%'
+        return self.db.execute(
+            '''
+            SELECT path, name, duration, size, streams FROM files
+            WHERE folder = ? AND (name LIKE ? OR streams LIKE ?)
+            ORDER BY name
+            ''',
+            (os.path.abspath(folder), pattern, pattern),
+        ).fetchall()
+
+    def poster(self, path: str) -> bytes:
+        row = self.db.execute('SELECT poster FROM files WHERE path = ?', (path,)).fetchone()
+        return row[0] if row else None
+
+
+class LibraryIndexWorker(QObject):
+    '''
+    Incrementally indexes a folder of recordings with a pool of processes
+    '''
+    progress = pyqtSignal(int)
+    updated = pyqtSignal()
+    done = pyqtSignal()
+
+    # how many indexed files to commit at a time
+    BATCH_SIZE = 16
+
+    def __init__(self, folder: str, db_file: str = None, parent=None) -> None:
+        super().__init__(parent)
+        self.folder = folder
+        self.db_file = db_file
+        self.stopped = False
+        self.pool = None
+
+    def stop(self) -> None:
+        self.stopped = True
+        # drop queued files right away instead of after the next one finishes
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+    def index(self):
+        # sqlite connections can't be shared across threads, so open our own
+        library = Library(self.db_file)
+        try:
+            stale = library.stale(self.folder)
+            self.updated.emit()
+            if stale and not self.stopped:
+                self._index_files(library, stale)
+        # stop() shutting the pool down mid-submit raises RuntimeError
+        except (OSError, RuntimeError):
+            pass
+        finally:
+            library.commit()
+            library.close()
+            self.progress.emit(100)
+            self.done.emit()
+
+    def _index_files(self, library: Library, stale: list):
+        self.progress.emit(0)
+        stats = {path: (mtime_ns, size) for path, mtime_ns, size in stale}
+
+        self.pool = ProcessPoolExecutor()
+        # stop() may have come in before there was a pool to shut down
+        if self.stopped:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            return
+
+        try:
+            futures = {self.pool.submit(index_file, path): path for path in stats}
+            for i, future in enumerate(as_completed(futures), start=1):
+                if self.stopped:
+                    break
+
+                # skip files which can't be indexed rather than giving up on the folder
+                try:
+                    library.add(future.result(), *stats[futures[future]])
+                except Exception:
+                    pass
+
+                if i % self.BATCH_SIZE == 0 or i == len(futures):
+                    library.commit()
+                    self.updated.emit()
+                self.progress.emit(int(i / len(futures) * 100))
+        finally:
+            # don't wait for files still being probed
+            self.pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,127 @@
+import json
+import os
+import re
+import subprocess
+from bisect import bisect_left
+
+from PyQt6.QtCore import QObject, pyqtSignal
+
+from .util import NO_WINDOW_FLAG, cache_dir, file_key
+
+
+class SceneIndex:
+    '''
+    Sorted scene cut timestamps (ms) of a source
+    '''
+
+    def __init__(self, cuts=()) -> None:
+        self.cuts = sorted(cuts)
+
+    def __len__(self) -> int:
+        return len(self.cuts)
+
+    def snap(self, time: int, threshold: int) -> int:
+        '''
+        Returns the cut closest to time if it is within threshold ms, otherwise time
+        '''
+        i = bisect_left(self.cuts, time)
+        neighbours = self.cuts[max(0, i - 1):i + 1]
+        if not neighbours:
+            return time
+
+        nearest = min(neighbours, key=lambda cut: abs(cut - time))
+        if abs(nearest - time) > threshold:
+            return time
+        return nearest
+
+    @staticmethod
+    def cache_file(file: str) -> str:
+        return os.path.join(cache_dir('scenes'), f'{file_key(file)}.json')
+
+    @classmethod
+    def load(cls, file: str):
+        '''
+        Loads the cached index of a source, or None if it hasn't been indexed
+        '''
+        try:
+            with open(cls.cache_file(file)) as f:
+                return cls(json.load(f))
+        except (OSError, ValueError):
+            return None
+
+    def save(self, file: str) -> None:
+        with open(self.cache_file(file), 'w') as f:
+            json.dump(self.cuts, f)
+
+
+class SceneDetectWorker(QObject):
+    '''
+    Builds the scene index of a source with a low priority ffmpeg pass
+    '''
+    indexed = pyqtSignal(object)
+    done = pyqtSignal()
+
+    BELOW_NORMAL_PRIORITY_FLAG = 0x00004000
+    # analysis width. cuts are just as visible at low resolution
+    ANALYSIS_WIDTH = 160
+    # scene score (0-1) above which a frame counts as a cut
+    THRESHOLD = 0.3
+
+    PTS_TIME_RE = re.compile(r'pts_time:\s*([\d.]+)')
+
+    def __init__(self, file: str, parent=None) -> None:
+        super().__init__(parent)
+        self.file = file
+        self.process = None
+        self.stopped = False
+
+    def stop(self) -> None:
+        self.stopped = True
+        if self.process is not None:
+            self.process.kill()
+
+    def detect(self):
+        index = SceneIndex.load(self.file)
+        if index is None:
+            index = self._detect()
+
+        if index is not None:
+            self.indexed.emit(index)
+        self.done.emit()
+
+    def _detect(self):
+        if self.stopped:
+            return None
+
+        self.process = subprocess.Popen([
+            'ffmpeg', '-hide_banner', '-nostats',
+            '-i', f'{self.file}',
+            '-an', '-sn', '-dn',
+            '-vf', (
+                f'scale={self.ANALYSIS_WIDTH}:-2,'
+                f'select=\'gt(scene,{self.THRESHOLD})\','
+                'showinfo'
+            ),
+            '-f', 'null', '-',
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+            creationflags=NO_WINDOW_FLAG | self.BELOW_NORMAL_PRIORITY_FLAG)
+        # stop() may have been called before there was a process to kill
+        if self.stopped:
+            self.process.kill()
+
+        cuts = []
+        for line in self.process.stderr:
+            # showinfo prints one line per selected frame
+            if 'Parsed_showinfo' not in line:
+                continue
+            match = self.PTS_TIME_RE.search(line)
+            if match:
+                cuts.append(int(float(match.group(1)) * 1e3))
+
+        self.process.wait()
+        if self.stopped or self.process.returncode != 0:
+            return None
+
+        index = SceneIndex(cuts)
+        index.save(self.file)
+        return index
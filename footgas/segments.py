@@ -0,0 +1,82 @@
+import hashlib
+import json
+import os
+import shutil
+
+from .util import cache_dir, file_key
+
+
+class SegmentCache:
+    '''
+    Encoded video segments of a source, kept between saves with the same settings.
+    Segments lie on a fixed grid over the source, so moving the clip start or end
+    only changes the segments at the edges of the clip
+    '''
+    SEGMENT_MS = 2000
+    MANIFEST = 'manifest.json'
+
+    def __init__(
+            self,
+            file: str,
+            resolution: str,
+            fps: int,
+            max_size_mb: int,
+            audio_bitrate_kb: int,
+    ) -> None:
+        # segment bitrates depend on the whole budget, so it's part of the key too
+        key = f'{file_key(file)}|{resolution}|{fps}|{max_size_mb}|{audio_bitrate_kb}'
+        self.key = hashlib.sha1(key.encode()).hexdigest()
+
+        # only the segments of the latest source/settings are kept around
+        root = cache_dir('segments')
+        for name in os.listdir(root):
+            if name != self.key:
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+        self.dir = cache_dir('segments', self.key)
+        try:
+            with open(self.path(self.MANIFEST)) as f:
+                self.segments = json.load(f)
+        except (OSError, ValueError):
+            self.segments = {}
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.dir, name)
+
+    def spans(self, start: int, end: int) -> list:
+        '''
+        Splits a clip (ms) into grid aligned (start, end) spans
+        '''
+        bounds = [start]
+        boundary = (start // self.SEGMENT_MS + 1) * self.SEGMENT_MS
+        while boundary < end:
+            bounds.append(boundary)
+            boundary += self.SEGMENT_MS
+        bounds.append(end)
+        return list(zip(bounds, bounds[1:]))
+
+    def get(self, span: tuple) -> dict:
+        '''
+        Returns the file, size (bytes) and bitrate (kbps) of an encoded span, if any
+        '''
+        segment = self.segments.get('{}-{}'.format(*span))
+        if segment is None or not os.path.isfile(self.path(segment['file'])):
+            return None
+        return segment
+
+    def put(self, span: tuple, file: str, rate: int) -> None:
+        key = '{}-{}'.format(*span)
+        old = self.segments.get(key)
+        if old is not None and old['file'] != file:
+            try:
+                os.remove(self.path(old['file']))
+            except OSError:
+                pass
+
+        self.segments[key] = {
+            'file': file,
+            'size': os.path.getsize(self.path(file)),
+            'rate': rate,
+        }
+        with open(self.path(self.MANIFEST), 'w') as f:
+            json.dump(self.segments, f)
@@ -1,5 +1,11 @@
+import hashlib
+import json
+import os
+import subprocess
 from datetime import timedelta
 
+NO_WINDOW_FLAG = 0x08000000
+
 
 def ftime(time: int, add_ms: bool = True) -> str:
     '''
@@ -27,3 +33,86 @@ def strtoms(time: str) -> int:
         key: float(val) for key, val in kwargs
     })
     return delta.seconds * 1e3 + delta.microseconds / 1e3
+
+
+def ffprobe(file: str) -> dict:
+    '''
+    Probes a media file with ffprobe and returns its format and stream info
+    '''
+    result = subprocess.run([
+        'ffprobe', '-hide_banner', '-loglevel', 'error',
+        '-print_format', 'json',
+        '-show_format', '-show_streams',
+        f'{file}',
+    ], capture_output=True, creationflags=NO_WINDOW_FLAG)
+    if result.returncode != 0:
+        return {}
+    return json.loads(result.stdout)
+
+
+def video_stream(probe: dict) -> dict:
+    '''
+    Returns the first video stream of an ffprobe result
+    '''
+    for stream in probe.get('streams', []):
+        if stream.get('codec_type') == 'video':
+            return stream
+    return {}
+
+
+def frame_rate(stream: dict) -> float:
+    '''
+    Turns an ffprobe stream's frame rate fraction into frames per second
+    '''
+    rate = stream.get('avg_frame_rate', '0/0')
+    if rate == '0/0':
+        rate = stream.get('r_frame_rate', '0/0')
+    num, _, den = rate.partition('/')
+    if not den or float(den) == 0:
+        return float(num or 0)
+    return float(num) / float(den)
+
+
+def cache_dir(*parts: str) -> str:
+    '''
+    Returns (and creates) a directory inside footgas' per-user cache
+    '''
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+    else:
+        base = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+    path = os.path.join(base, 'footgas', *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def file_key(file: str) -> str:
+    '''
+    Key identifying a file's current contents by its path, size and mtime
+    '''
+    stat = os.stat(file)
+    key = f'{os.path.abspath(file)}|{stat.st_size}|{stat.st_mtime_ns}'
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def keyframe_before(file: str, time: float) -> float:
+    '''
+    Returns the time (s) of the last video keyframe at or before a time (s)
+    '''
+    result = subprocess.run([
+        'ffprobe', '-hide_banner', '-loglevel', 'error',
+        '-select_streams', 'v:0',
+        '-skip_frame', 'nokey',
+        '-read_intervals', f'{max(0, time - 30)}%{time + 0.001}',
+        '-show_entries', 'frame=best_effort_timestamp_time',
+        '-of', 'csv=p=0',
+        f'{file}',
+    ], capture_output=True, text=True, creationflags=NO_WINDOW_FLAG)
+
+    keyframes = []
+    for line in result.stdout.split():
+        try:
+            keyframes.append(float(line.strip(',')))
+        except ValueError:
+            continue
+    return max((t for t in keyframes if t <= time), default=0.0)
@@ -1,5 +1,5 @@
 from PyQt6.QtCore import pyqtSignal
-from PyQt6.QtWidgets import (QComboBox, QFileDialog, QHBoxLayout, QVBoxLayout, QLabel,
+from PyQt6.QtWidgets import (QCheckBox, QComboBox, QFileDialog, QHBoxLayout, QVBoxLayout, QLabel,
                              QLineEdit, QPushButton, QWidget, QMessageBox)
 
 from ..util import ftime, strtoms
@@ -8,6 +8,7 @@ from ..util import ftime, strtoms
 class FootgasOptionsWidget(QWidget):
     sourceSelected = pyqtSignal(str)
     save = pyqtSignal(str)
+    preview = pyqtSignal()
     overrideStartChanged = pyqtSignal(int)
     overrideEndChanged = pyqtSignal(int)
     startNowClicked = pyqtSignal()
@@ -31,6 +32,11 @@ class FootgasOptionsWidget(QWidget):
         self.w_save.setEnabled(False)
         self.w_save.clicked.connect(self._save)
 
+        self.w_preview = QPushButton('Preview')
+        self.w_preview.setToolTip('Quickly render a preview at the bitrate the clip will be saved at')
+        self.w_preview.setEnabled(False)
+        self.w_preview.clicked.connect(self._preview)
+
         start_label = QLabel()
         start_label.setText('Start:')
         self.w_override_start = QLineEdit()
@@ -63,6 +69,10 @@ class FootgasOptionsWidget(QWidget):
         time_end_box.addWidget(self.w_override_end)
         time_end_box.addWidget(self.w_end_now)
 
+        self.w_snap_scenes = QCheckBox('Snap to cuts')
+        self.w_snap_scenes.setToolTip('Snap clip start/end to nearby scene cuts')
+        self.w_snap_scenes.setEnabled(False)
+
         max_size_label = QLabel()
         max_size_label.setText('Max filesize (MB):')
         self.w_max_size = QLineEdit()
@@ -83,6 +93,22 @@ class FootgasOptionsWidget(QWidget):
         self.w_fps.addItem('24FPS')
         self.w_fps.setCurrentIndex(2)
 
+        self.w_fragmented = QCheckBox('Streamable')
+        self.w_fragmented.setToolTip('Write fragmented MP4 which can be read/uploaded while it is being saved')
+        self.w_fragmented.toggled.connect(self._toggle_stream_url)
+
+        self.w_stream_url = QLineEdit()
+        self.w_stream_url.setPlaceholderText('Stream to (optional)')
+        self.w_stream_url.setToolTip(
+            'ffmpeg output URL to stream the clip to instead of a file, e.g. tcp://host:port'
+        )
+        self.w_stream_url.setEnabled(False)
+
+        self.w_incremental = QCheckBox('Fast re-save')
+        self.w_incremental.setToolTip(
+            'Keep encoded segments between saves so small range changes save quickly'
+        )
+
         audio_bitrate_label = QLabel()
         audio_bitrate_label.setText('Audio bitrate:')
         self.w_audio_bitrate = QComboBox()
@@ -94,14 +120,19 @@ class FootgasOptionsWidget(QWidget):
         options_box = QHBoxLayout()
         options_box.addWidget(self.w_video_select)
         options_box.addWidget(self.w_save)
+        options_box.addWidget(self.w_preview)
         options_box.addWidget(start_label)
         options_box.addLayout(time_start_box)
         options_box.addWidget(end_label)
         options_box.addLayout(time_end_box)
+        options_box.addWidget(self.w_snap_scenes)
         options_box.addWidget(self.w_resolution)
         options_box.addWidget(self.w_fps)
         options_box.addWidget(audio_bitrate_label)
         options_box.addWidget(self.w_audio_bitrate)
+        options_box.addWidget(self.w_fragmented)
+        options_box.addWidget(self.w_stream_url)
+        options_box.addWidget(self.w_incremental)
         options_box.addWidget(max_size_label)
         options_box.addWidget(self.w_max_size)
 
@@ -109,10 +140,12 @@ class FootgasOptionsWidget(QWidget):
 
     def setEnabled(self, enabled: bool) -> None:
         self.w_save.setEnabled(enabled)
+        self.w_preview.setEnabled(enabled)
         self.w_override_start.setEnabled(enabled)
         self.w_override_end.setEnabled(enabled)
         self.w_start_now.setEnabled(enabled)
         self.w_end_now.setEnabled(enabled)
+        self.w_snap_scenes.setEnabled(enabled)
 
     def setStart(self, start: int) -> None:
         time = ftime(start)
@@ -134,6 +167,15 @@ class FootgasOptionsWidget(QWidget):
             self.external_set = True
         self.w_override_end.setText(time)
 
+    def snapToScenes(self) -> bool:
+        return self.w_snap_scenes.isChecked()
+
+    def fragmented(self) -> bool:
+        return self.w_fragmented.isChecked()
+
+    def incremental(self) -> bool:
+        return self.w_incremental.isChecked()
+
     def maxFileSize(self) -> int:
         return int(self.w_max_size.text())
 
@@ -153,7 +195,7 @@ class FootgasOptionsWidget(QWidget):
 
         self.sourceSelected.emit(fn)
 
-    def _save(self):
+    def _check_range(self) -> bool:
         start, end = map(strtoms, (self.w_override_start.text(), self.w_override_end.text()))
         if start >= end:
             error_popup = QMessageBox()
@@ -161,6 +203,26 @@ class FootgasOptionsWidget(QWidget):
             error_popup.setIcon(QMessageBox.Icon.Warning)
             error_popup.setText('Clip cannot start before it ends!')
             error_popup.exec()
+            return False
+        return True
+
+    def _preview(self):
+        if not self._check_range():
+            return
+
+        self.preview.emit()
+
+    def _toggle_stream_url(self, streamable: bool):
+        self.w_stream_url.setEnabled(streamable)
+
+    def _save(self):
+        if not self._check_range():
+            return
+
+        # streamable clips can go straight to a sink instead of a file
+        stream_url = self.w_stream_url.text().strip()
+        if self.fragmented() and stream_url:
+            self.save.emit(stream_url)
             return
 
         out_fn, _ = QFileDialog.getSaveFileName(
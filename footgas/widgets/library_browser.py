@@ -0,0 +1,202 @@
+from PyQt6.QtCore import QAbstractTableModel, QModelIndex, QSize, Qt, QThread, pyqtSignal
+from PyQt6.QtGui import QPixmap
+from PyQt6.QtWidgets import (QAbstractItemView, QFileDialog, QHBoxLayout, QHeaderView,
+                             QLineEdit, QProgressBar, QPushButton, QTableView,
+                             QVBoxLayout, QWidget)
+
+from ..library import Library, LibraryIndexWorker
+from ..util import ftime
+
+
+class LibraryModel(QAbstractTableModel):
+    '''
+    Table of indexed recordings. Posters are loaded lazily as rows are shown
+    '''
+    HEADERS = ('Name', 'Duration', 'Size', 'Streams')
+
+    def __init__(self, library: Library) -> None:
+        super().__init__()
+
+        self.library = library
+        self.rows = []
+        self.posters = {}
+
+    def setRows(self, rows: list) -> None:
+        '''
+        Updates the table to the given rows, touching only the rows which changed
+        so selection, scroll position and loaded posters survive refreshes
+        '''
+        new_paths = {row[0] for row in rows}
+        if not new_paths.intersection(row[0] for row in self.rows):
+            self.beginResetModel()
+            self.rows = list(rows)
+            self.posters.clear()
+            self.endResetModel()
+            return
+
+        # drop rows which are gone, back to front so indexes stay valid
+        for i in reversed(range(len(self.rows))):
+            path = self.rows[i][0]
+            if path not in new_paths:
+                self.beginRemoveRows(QModelIndex(), i, i)
+                del self.rows[i]
+                self.posters.pop(path, None)
+                self.endRemoveRows()
+
+        # both are sorted the same way, so what's left is a subsequence of rows
+        for i, row in enumerate(rows):
+            if i >= len(self.rows) or self.rows[i][0] != row[0]:
+                self.beginInsertRows(QModelIndex(), i, i)
+                self.rows.insert(i, row)
+                self.endInsertRows()
+            elif self.rows[i] != row:
+                self.rows[i] = row
+                self.posters.pop(row[0], None)
+                self.dataChanged.emit(
+                    self.index(i, 0), self.index(i, len(self.HEADERS) - 1)
+                )
+
+    def path(self, row: int) -> str:
+        return self.rows[row][0]
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return self.HEADERS[section]
+        return None
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        path, name, duration, size, streams = self.rows[index.row()]
+        column = index.column()
+
+        if role == Qt.ItemDataRole.DisplayRole:
+            if column == 0:
+                return name
+            if column == 1:
+                return ftime(int((duration or 0) * 1e3), add_ms=False)
+            if column == 2:
+                return f'{size / 1e6:.1f} MB'
+            return streams
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return path
+        if role == Qt.ItemDataRole.DecorationRole and column == 0:
+            if path not in self.posters:
+                pixmap = QPixmap()
+                poster = self.library.poster(path)
+                if poster:
+                    pixmap.loadFromData(poster)
+                self.posters[path] = pixmap
+            return self.posters[path]
+        return None
+
+
+class LibraryBrowserWidget(QWidget):
+    '''
+    Browses and filters an indexed folder of recordings
+    '''
+    sourceSelected = pyqtSignal(str)
+
+    def __init__(self) -> None:
+        super().__init__()
+
+        self.folder = None
+        self.index_worker = None
+        self.index_t = None
+        self.library = Library()
+
+        self.populate()
+
+    def populate(self):
+        self.w_open_folder = QPushButton('Open folder')
+        self.w_open_folder.clicked.connect(self._select_folder)
+
+        self.w_filter = QLineEdit()
+        self.w_filter.setPlaceholderText('Filter')
+        self.w_filter.textChanged.connect(self._refresh)
+
+        self.model = LibraryModel(self.library)
+        self.w_files = QTableView()
+        self.w_files.setModel(self.model)
+        self.w_files.setIconSize(QSize(Library.POSTER_WIDTH // 2, Library.POSTER_WIDTH // 2))
+        self.w_files.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.w_files.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.w_files.verticalHeader().hide()
+        self.w_files.horizontalHeader().setSectionResizeMode(
+            0, QHeaderView.ResizeMode.Stretch
+        )
+        self.w_files.doubleClicked.connect(
+            lambda index: self.sourceSelected.emit(self.model.path(index.row()))
+        )
+
+        self.w_progress = QProgressBar()
+        self.w_progress.setRange(0, 100)
+        self.w_progress.hide()
+
+        top_box = QHBoxLayout()
+        top_box.addWidget(self.w_open_folder)
+        top_box.addWidget(self.w_filter)
+
+        layout = QVBoxLayout()
+        layout.addLayout(top_box)
+        layout.addWidget(self.w_files, stretch=1)
+        layout.addWidget(self.w_progress)
+
+        self.setLayout(layout)
+
+    def setFolder(self, folder: str) -> None:
+        self.folder = folder
+        self._refresh()
+        self._index_folder()
+
+    def stopIndexing(self) -> None:
+        if self.index_worker is None:
+            return
+        self.index_worker.stop()
+        # the thread must be finished before it can be let go of
+        self.index_t.quit()
+        self.index_t.wait()
+        self.index_worker = None
+        self.index_t = None
+
+    def _select_folder(self):
+        folder = QFileDialog.getExistingDirectory(self, 'Select recordings folder')
+        if not folder:
+            return
+
+        self.setFolder(folder)
+
+    def _refresh(self):
+        if self.folder is None:
+            return
+        self.model.setRows(self.library.query(self.folder, self.w_filter.text()))
+
+    def _index_done(self):
+        # a replaced worker finishing shouldn't hide the current one's progress
+        if self.sender() is self.index_worker:
+            self.w_progress.hide()
+
+    def _index_folder(self):
+        self.stopIndexing()
+
+        self.index_t = QThread()
+        self.index_worker = LibraryIndexWorker(self.folder, db_file=self.library.db_file)
+        self.index_worker.moveToThread(self.index_t)
+
+        self.index_t.started.connect(self.index_worker.index)
+        self.index_worker.done.connect(self.index_worker.deleteLater)
+        self.index_worker.done.connect(self.index_t.quit)
+
+        self.index_worker.progress.connect(
+            lambda p: self.w_progress.setValue(p)
+        )
+        self.index_worker.updated.connect(self._refresh)
+        self.index_worker.done.connect(self._index_done)
+
+        self.w_progress.setValue(0)
+        self.w_progress.show()
+        self.index_t.start()
@@ -1,10 +1,12 @@
-from PyQt6.QtCore import Qt, QUrl, pyqtSignal, QEvent
+from PyQt6.QtCore import Qt, QThread, QUrl, pyqtSignal, QEvent
+from PyQt6.QtGui import QImage, QPixmap
 from PyQt6.QtMultimedia import QAudioOutput, QMediaPlayer
 from PyQt6.QtMultimediaWidgets import QVideoWidget
-from PyQt6.QtWidgets import (QHBoxLayout, QLabel, QPushButton, QSlider, QStyle,
-                             QVBoxLayout, QWidget)
+from PyQt6.QtWidgets import (QHBoxLayout, QLabel, QPushButton, QSlider, QStackedWidget,
+                             QStyle, QVBoxLayout, QWidget)
 
-from ..util import ftime
+from ..frame_cache import FrameDecoder, FrameRingCache
+from ..util import ffprobe, frame_rate, ftime, video_stream
 
 
 class MediaControlWidget(QWidget):
@@ -12,6 +14,7 @@ class MediaControlWidget(QWidget):
     volumeChanged = pyqtSignal(float)
     togglePlay = pyqtSignal(bool)
     toggleMute = pyqtSignal(bool)
+    frameStep = pyqtSignal(int)
 
     def __init__(self) -> None:
         super().__init__()
@@ -30,6 +33,22 @@ class MediaControlWidget(QWidget):
         ))
         self.w_play_pause.clicked.connect(self._toggle_play)
 
+        # Frame stepping
+        self.w_prev_frame = QPushButton()
+        self.w_prev_frame.setIcon(self.style().standardIcon(
+            QStyle.StandardPixmap.SP_MediaSeekBackward
+        ))
+        self.w_prev_frame.setToolTip('Previous frame')
+        self.w_prev_frame.setAutoRepeat(True)
+        self.w_prev_frame.clicked.connect(lambda: self.frameStep.emit(-1))
+        self.w_next_frame = QPushButton()
+        self.w_next_frame.setIcon(self.style().standardIcon(
+            QStyle.StandardPixmap.SP_MediaSeekForward
+        ))
+        self.w_next_frame.setToolTip('Next frame')
+        self.w_next_frame.setAutoRepeat(True)
+        self.w_next_frame.clicked.connect(lambda: self.frameStep.emit(1))
+
         self.w_time_label = QLabel('- / -')
 
         self.w_seek = QSlider(Qt.Orientation.Horizontal)
@@ -52,7 +71,9 @@ class MediaControlWidget(QWidget):
         self.w_audio.sliderMoved.connect(self._update_volume)
 
         media_control_box = QHBoxLayout()
+        media_control_box.addWidget(self.w_prev_frame)
         media_control_box.addWidget(self.w_play_pause)
+        media_control_box.addWidget(self.w_next_frame)
         media_control_box.addWidget(self.w_time_label)
         media_control_box.addWidget(self.w_seek)
         media_control_box.addWidget(self.w_mute)
@@ -62,10 +83,16 @@ class MediaControlWidget(QWidget):
 
     def setEnabled(self, enabled: bool):
         self.w_play_pause.setEnabled(enabled)
+        self.w_prev_frame.setEnabled(enabled)
+        self.w_next_frame.setEnabled(enabled)
         self.w_audio.setEnabled(enabled)
         self.w_seek.setEnabled(enabled)
         self.w_audio.setEnabled(enabled)
 
+    def setFrameStepping(self, enabled: bool):
+        self.w_prev_frame.setVisible(enabled)
+        self.w_next_frame.setVisible(enabled)
+
     def setPlaying(self, playing: bool):
         if self.playing != playing:
             self._toggle_play()
@@ -136,13 +163,31 @@ class VideoPlayerWidget(QWidget):
     positionChanged = pyqtSignal(int)
     videoDropped = pyqtSignal(str)
 
-    def __init__(self, initial_volume: float = 0.1) -> None:
+    # max amount of decoded frames kept around the playhead for frame stepping
+    FRAME_CACHE_SIZE = 120
+
+    def __init__(
+            self,
+            initial_volume: float = 0.1,
+            frame_cache_size: int = FRAME_CACHE_SIZE,
+            frame_stepping: bool = True,
+    ) -> None:
         super().__init__()
 
         self.start_time = 0
         self.end_time = 0
         self.fix_thumbnail = False
 
+        # frame stepping state. step_position is None while not stepping
+        self.frame_stepping = frame_stepping
+        self.frame_cache = FrameRingCache(max_frames=frame_cache_size)
+        self.frame_decoder = None
+        self.frame_decode_t = None
+        self.source_fps = 0
+        self.step_position = None
+        self.step_frame = 0
+        self.shown_frame = None
+
         self.populate(initial_volume=initial_volume)
 
     def populate(self, initial_volume: int = 0) -> None:
@@ -156,6 +201,14 @@ class VideoPlayerWidget(QWidget):
         self.video_player.setAudioOutput(self.audio_player)
         self.video_player.setVideoOutput(self.w_player)
 
+        # Shows cached frames while frame stepping
+        self.w_frame = QLabel()
+        self.w_frame.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        self.w_frame.setStyleSheet('background-color: black')
+        self.w_display = QStackedWidget()
+        self.w_display.addWidget(self.w_player)
+        self.w_display.addWidget(self.w_frame)
+
         # Drop events are bugged with videowidgets. This is a workaround
         w_player_window = self.w_player.findChild(QWidget)
         w_player_window.installEventFilter(self)
@@ -166,9 +219,11 @@ class VideoPlayerWidget(QWidget):
         self.media_control.toggleMute.connect(self._toggle_mute)
         self.media_control.volumeChanged.connect(self._set_volume)
         self.media_control.seek.connect(self._seek)
+        self.media_control.frameStep.connect(self.stepFrame)
+        self.media_control.setFrameStepping(self.frame_stepping)
 
         layout = QVBoxLayout()
-        layout.addWidget(self.w_player, stretch=1)
+        layout.addWidget(self.w_display, stretch=1)
         layout.addWidget(self.media_control)
         layout.setContentsMargins(0, 0, 0, 0)
 
@@ -193,6 +248,7 @@ class VideoPlayerWidget(QWidget):
         self.media_control.setEnabled(enabled)
 
     def setSource(self, source: QUrl):
+        self._stop_stepping(seek=False)
         self.fix_thumbnail = True
         self.video_player.setSource(source)
         self.media_control.setPlaying(False)
@@ -202,10 +258,20 @@ class VideoPlayerWidget(QWidget):
         self.start_time = 0
         self.end_time = self.video_player.duration()
 
+        if self.frame_stepping:
+            self._start_frame_decoder(source.toLocalFile())
+
+    def play(self) -> None:
+        self.fix_thumbnail = False
+        self.media_control.setPlaying(True)
+
     def position(self) -> int:
+        if self.step_position is not None:
+            return self.step_position
         return self.video_player.position()
 
     def setPosition(self, position: int):
+        self._stop_stepping(seek=False)
         self.video_player.setPosition(position)
         self.media_control.setPosition(position)
 
@@ -229,8 +295,109 @@ class VideoPlayerWidget(QWidget):
     def duration(self) -> int:
         return self.video_player.duration()
 
+    def stepFrame(self, step: int) -> None:
+        '''
+        Move the playhead by a number of frames, showing cached frames instantly
+        '''
+        if self.frame_decoder is None:
+            return
+
+        if self.step_position is None:
+            self.media_control.setPlaying(False)
+            self.step_frame = round(self.video_player.position() * self.source_fps / 1e3)
+        first = int(self.start_time * self.source_fps / 1e3)
+        last = int(self.end_time * self.source_fps / 1e3)
+        self.step_frame = min(last, max(first, self.step_frame + step))
+        self.step_position = int(self.step_frame * 1e3 / self.source_fps)
+
+        self.frame_cache.setPlayhead(self.step_frame, step)
+        if self.step_frame in self.frame_cache:
+            self._show_frame(self.step_frame)
+
+        # prefetch a whole chunk in the direction of travel once the frames
+        # ahead run low, rather than a few frames on every step
+        if self.frame_cache.needsPrefetch():
+            missing = self.frame_cache.missing(
+                *self.frame_cache.window(self.step_frame, step)
+            )
+            if missing is not None:
+                self.frame_decoder.request(*missing)
+
+        self.media_control.setPosition(self.step_position)
+        self.positionChanged.emit(self.step_position)
+
+    def stopFrameDecoder(self) -> None:
+        if self.frame_decoder is None:
+            return
+        self.frame_decoder.stop()
+        # the thread must be finished before it can be let go of
+        self.frame_decode_t.quit()
+        self.frame_decode_t.wait()
+        self.frame_decoder = None
+        self.frame_decode_t = None
+        self.frame_cache.clear()
+
+    def _start_frame_decoder(self, file: str):
+        self.stopFrameDecoder()
+
+        probe = ffprobe(file)
+        stream = video_stream(probe)
+        self.source_fps = frame_rate(stream)
+        if not stream or not self.source_fps:
+            return
+
+        # decode frames at the size they will be displayed at
+        src_w, src_h = int(stream['width']), int(stream['height'])
+        scale = min(
+            self.w_display.width() / src_w,
+            self.w_display.height() / src_h,
+            1,
+        )
+        width = max(2, int(src_w * scale) // 2 * 2)
+        height = max(2, int(src_h * scale) // 2 * 2)
+
+        duration = float(stream.get('duration') or probe['format'].get('duration', 0))
+        self.frame_cache.frame_count = int(duration * self.source_fps)
+
+        self.frame_decode_t = QThread()
+        self.frame_decoder = FrameDecoder(file, self.source_fps, width, height)
+        self.frame_decoder.moveToThread(self.frame_decode_t)
+
+        self.frame_decode_t.started.connect(self.frame_decoder.run)
+        self.frame_decoder.done.connect(self.frame_decoder.deleteLater)
+        self.frame_decoder.done.connect(self.frame_decode_t.quit)
+        self.frame_decoder.frameDecoded.connect(self._frame_decoded)
+
+        self.frame_decode_t.start()
+
+    def _frame_decoded(self, index: int, image: QImage):
+        if self.frame_decoder is None or self.sender() is not self.frame_decoder:
+            return
+        self.frame_cache.put(index, image)
+        if self.step_position is not None and index == self.step_frame:
+            self._show_frame(index)
+
+    def _show_frame(self, index: int):
+        if self.shown_frame != index:
+            self.shown_frame = index
+            self.w_frame.setPixmap(QPixmap.fromImage(self.frame_cache.get(index)))
+        self.w_display.setCurrentWidget(self.w_frame)
+
+    def _stop_stepping(self, seek: bool = True):
+        '''
+        Hand the playhead back to the media player after frame stepping
+        '''
+        if self.step_position is None:
+            return
+        if seek:
+            self.video_player.setPosition(self.step_position)
+        self.step_position = None
+        self.shown_frame = None
+        self.w_display.setCurrentWidget(self.w_player)
+
     def _toggle_play(self, playing: bool):
         if playing:
+            self._stop_stepping()
             self.video_player.play()
         else:
             self.video_player.pause()
@@ -242,6 +409,10 @@ class VideoPlayerWidget(QWidget):
         self.audio_player.setVolume(volume)
 
     def _seek(self, position: int):
+        # the seek slider follows the playhead while frame stepping
+        if position == self.step_position:
+            return
+        self._stop_stepping(seek=False)
         position = min(self.end_time, max(self.start_time, position))
         self.video_player.setPosition(position)
         self.media_control.setTime(position)
@@ -271,6 +442,8 @@ class VideoPlayerWidget(QWidget):
         self.durationChanged.emit(duration)
 
     def _update_position(self, position: int):
+        if self.step_position is not None:
+            return
         if position > self.end_time or position < self.start_time:
             self.video_player.setPosition(self.start_time)
             return
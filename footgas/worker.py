@@ -3,14 +3,39 @@ import subprocess
 
 from PyQt6.QtCore import QObject, pyqtSignal
 
-from .util import strtoms
+from .segments import SegmentCache
+from .util import NO_WINDOW_FLAG, ffprobe, frame_rate, ftime, keyframe_before, strtoms, video_stream
 
 
 class SaveWorker(QObject):
     progress = pyqtSignal(int)
+    warning = pyqtSignal(str)
     done = pyqtSignal()
 
-    NO_WINDOW_FLAG = 0x08000000
+    # lets the output be read while it's being written
+    FRAGMENT_MOVFLAGS = '+frag_keyframe+empty_moov+default_base_moof'
+    # longest fragment, which bounds how far -fs can overshoot
+    FRAGMENT_DURATION_US = 1000000
+    # share of the -fs limit aimed for when streaming, as there are no retries
+    STREAM_RATE_MARGIN = 0.9
+    # how far (s) a streamed clip may end before the requested end without a warning
+    STREAM_DURATION_TOLERANCE = 0.5
+    # sources which can be stream copied if they already fit
+    PASSTHROUGH_VIDEO_CODECS = ('h264',)
+    PASSTHROUGH_AUDIO_CODECS = ('aac',)
+    # how far (s) a stream copied clip may be off the requested duration
+    PASSTHROUGH_DURATION_TOLERANCE = 0.5
+    # most bitrates to try at once when an encode overshoots
+    MAX_CANDIDATES = 4
+    # relative bitrate step between candidates
+    CANDIDATE_SPREAD = 0.05
+    # share of the max filesize set aside for the mp4 container
+    CONTAINER_OVERHEAD = 0.02
+    # most a segment may differ from the clip's even bitrate, either way
+    MAX_RATE_DIVERGENCE = 1.25
+    # share of the video budget segments leave free, so small edits fit without
+    # re-encoding most of the clip
+    SEGMENT_HEADROOM = 0.05
 
     def __init__(
             self,
@@ -22,6 +47,8 @@ class SaveWorker(QObject):
             resolution: str = '1280x720',
             fps: int = 30,
             audio_bitrate_kb: int = 128,
+            fragmented: bool = False,
+            incremental: bool = False,
             parent=None,
     ) -> None:
         super().__init__(parent)
@@ -33,10 +60,30 @@ class SaveWorker(QObject):
         self.resolution = resolution
         self.fps = fps
         self.audio_bitrate_kb = audio_bitrate_kb
+        self.fragmented = fragmented
+        self.incremental = incremental
 
     def save_clip(self):
+        if self.fragmented:
+            self._stream_clip()
+            return
+
         self.progress.emit(10)
 
+        # no need to re-encode if the source already fits
+        if self._passthrough():
+            self.progress.emit(100)
+            self.done.emit()
+            return
+
+        if self.incremental:
+            if self._save_segmented():
+                self.progress.emit(100)
+                self.done.emit()
+                return
+            # start over on the regular encode
+            self.progress.emit(10)
+
         # trim the clip first
         trimmed_file = f'{self.file}-TRIMMED.tmp'
         subprocess.run([
@@ -46,59 +93,44 @@ class SaveWorker(QObject):
             '-i', f'{self.file}',
             '-f', 'mp4',
             f'{trimmed_file}',
-        ], creationflags=self.NO_WINDOW_FLAG)
+        ], creationflags=NO_WINDOW_FLAG)
 
         self.progress.emit(40)
 
         # get the max bitrate we can encode at
-        duration = (strtoms(self.end) - strtoms(self.start)) / 1e3
-        max_encode_rate = ((self.max_size_mb * 8192) / duration)
-        max_encode_rate -= self.audio_bitrate_kb
-        max_encode_rate = int(max_encode_rate)
+        max_encode_rate = self._max_encode_rate()
 
         self.progress.emit(50)
 
         # encode once
-        subprocess.run([
-            'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
-            '-i', f'{trimmed_file}',
-            '-c:v', 'libx264',
-            '-fpsmax',  f'{self.fps}', '-s', f'{self.resolution}',
-            '-b:v', f'{max_encode_rate} K',
-            '-maxrate:v', f'{max_encode_rate} K',
-            '-b:a', f'{self.audio_bitrate_kb} K',
-            '-maxrate:a', f'{self.audio_bitrate_kb} K',
-            f'{self.out_file}'
-        ], creationflags=self.NO_WINDOW_FLAG)
+        subprocess.run(
+            self._encode_args(trimmed_file, max_encode_rate, self.out_file),
+            creationflags=NO_WINDOW_FLAG,
+        )
 
         self.progress.emit(75)
 
         # check file size.
         # keep re-encoding at progressively lower quality
         quality_factor = 1
-        encode_rate = max_encode_rate
         prog = 75
         size = os.path.getsize(self.out_file) / 1e6
         first_size_diff = size - self.max_size_mb
+        # use idle cores to try several bitrates per round
+        candidates = max(1, min(self.MAX_CANDIDATES, (os.cpu_count() or 1) // 2))
         while size > self.max_size_mb:
             # this should converge on the largest possible bitrate
             # while staying under the filesize limit
             quality_factor = quality_factor * (self.max_size_mb / size)
-            encode_rate = max_encode_rate * quality_factor
-
-            subprocess.run([
-                'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
-                '-i', f'{trimmed_file}',
-                '-c:v', 'libx264',
-                '-fpsmax',  f'{self.fps}', '-s', f'{self.resolution}',
-                '-b:v', f'{encode_rate} K',
-                '-maxrate:v', f'{encode_rate} K',
-                '-b:a', f'{self.audio_bitrate_kb} K',
-                '-maxrate:a', f'{self.audio_bitrate_kb} K',
-                f'{self.out_file}'
-            ], creationflags=self.NO_WINDOW_FLAG)
 
-            size = os.path.getsize(self.out_file) / 1e6
+            # spread the candidates evenly on both sides of the prediction
+            factors = [
+                quality_factor * (1 + self.CANDIDATE_SPREAD * ((candidates - 1) / 2 - i))
+                for i in range(candidates)
+            ]
+            quality_factor, size = self._encode_candidates(
+                trimmed_file, max_encode_rate, factors
+            )
 
             # very difficult to judge progress here but it's something?
             # basically check how close the filesize is to the goal size
@@ -110,3 +142,399 @@ class SaveWorker(QObject):
         os.remove(trimmed_file)
         self.progress.emit(100)
         self.done.emit()
+
+    def _encode_args(self, in_file: str, encode_rate: int, out_file: str, threads: int = None) -> list:
+        '''
+        ffmpeg arguments for encoding a trimmed clip at a video bitrate (kbps)
+        '''
+        encode_rate = int(encode_rate)
+        args = [
+            'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+            '-i', f'{in_file}',
+            '-c:v', 'libx264',
+            '-fpsmax',  f'{self.fps}', '-s', f'{self.resolution}',
+            '-b:v', f'{encode_rate} K',
+            '-maxrate:v', f'{encode_rate} K',
+            '-b:a', f'{self.audio_bitrate_kb} K',
+            '-maxrate:a', f'{self.audio_bitrate_kb} K',
+        ]
+        if threads is not None:
+            args += ['-threads', f'{threads}']
+        return args + ['-f', 'mp4', f'{out_file}']
+
+    def _encode_candidates(self, in_file: str, max_encode_rate: int, factors: list) -> tuple:
+        '''
+        Encodes at several fractions of the max bitrate at once. The largest
+        output under the max filesize is kept and the others are killed.
+        Returns the quality factor and size (MB) of the kept output, or of the
+        smallest candidate if none of them fit
+        '''
+        factors = sorted(factors, reverse=True)
+        threads = max(1, (os.cpu_count() or 1) // len(factors))
+
+        candidates = []
+        for i, factor in enumerate(factors):
+            out_file = f'{self.out_file}-CANDIDATE{i}.tmp'
+            process = subprocess.Popen(
+                self._encode_args(in_file, max_encode_rate * factor, out_file, threads=threads),
+                creationflags=NO_WINDOW_FLAG,
+            )
+            candidates.append((factor, out_file, process))
+
+        # candidates are ordered by bitrate, so the first one that fits wins
+        winner = None
+        smallest = None
+        try:
+            for factor, out_file, process in candidates:
+                if winner is not None:
+                    break
+                if process.wait() != 0 or not os.path.isfile(out_file):
+                    continue
+
+                size = os.path.getsize(out_file) / 1e6
+                if size <= self.max_size_mb:
+                    winner = (factor, size)
+                    os.replace(out_file, self.out_file)
+                smallest = (factor, size)
+        finally:
+            # whatever is still running lost, or something went wrong
+            for _, out_file, process in candidates:
+                process.kill()
+                process.wait()
+                if os.path.exists(out_file):
+                    os.remove(out_file)
+
+        if smallest is None:
+            raise RuntimeError('every candidate encode failed')
+        return winner or smallest
+
+    def _save_segmented(self) -> bool:
+        '''
+        Encodes the clip video as grid aligned segments which are cached between
+        saves. Only segments which changed since the last save of the same source
+        and settings are encoded, with the size budget rebalanced over them.
+        Returns whether the clip was saved
+        '''
+        cache = SegmentCache(
+            self.file, self.resolution, self.fps, self.max_size_mb, self.audio_bitrate_kb
+        )
+        start, end = round(strtoms(self.start)), round(strtoms(self.end))
+        spans = cache.spans(start, end)
+
+        # audio is cheap, so always encode it in one go
+        audio_file = cache.path('audio.m4a')
+        if os.path.exists(audio_file):
+            os.remove(audio_file)
+        result = subprocess.run([
+            'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+            '-ss', f'{start / 1e3}',
+            '-to', f'{end / 1e3}',
+            '-i', f'{self.file}',
+            '-vn', '-sn',
+            '-b:a', f'{self.audio_bitrate_kb} K',
+            '-maxrate:a', f'{self.audio_bitrate_kb} K',
+            '-f', 'mp4',
+            f'{audio_file}',
+        ], creationflags=NO_WINDOW_FLAG)
+        has_audio = result.returncode == 0 and os.path.isfile(audio_file) \
+            and os.path.getsize(audio_file) > 0
+        audio_size = os.path.getsize(audio_file) if has_audio else 0
+
+        self.progress.emit(20)
+
+        video_budget = self.max_size_mb * 1e6 * (1 - self.CONTAINER_OVERHEAD) - audio_size
+        reused = {span for span in spans if cache.get(span) is not None}
+        quality_factor = 1
+        while True:
+            encode_rate = self._rebalance(cache, spans, reused, video_budget * quality_factor)
+            new_spans = [span for span in spans if span not in reused]
+            if new_spans and encode_rate < 1:
+                return False
+
+            for i, span in enumerate(new_spans):
+                if not self._encode_segment(cache, span, encode_rate):
+                    return False
+                self.progress.emit(20 + int((i + 1) / len(new_spans) * 60))
+
+            # stitch the segments back together
+            concat_file = cache.path('concat.txt')
+            with open(concat_file, 'w') as f:
+                for span in spans:
+                    f.write(f'file \'{cache.path(cache.get(span)["file"])}\'\n')
+
+            args = [
+                'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+                '-f', 'concat', '-safe', '0',
+                '-i', f'{concat_file}',
+            ]
+            if has_audio:
+                args += ['-i', f'{audio_file}', '-map', '0:v', '-map', '1:a']
+            result = subprocess.run(args + [
+                '-c', 'copy',
+                '-f', 'mp4',
+                f'{self.out_file}',
+            ], creationflags=NO_WINDOW_FLAG)
+            if result.returncode != 0 or not os.path.isfile(self.out_file):
+                return False
+
+            size = os.path.getsize(self.out_file) / 1e6
+            if size <= self.max_size_mb:
+                return True
+
+            # overshot. redo every segment at a lower bitrate
+            quality_factor = quality_factor * (self.max_size_mb / size)
+            reused = set()
+            self.progress.emit(80)
+
+    def _rebalance(self, cache: SegmentCache, spans: list, reused: set, budget: float) -> int:
+        '''
+        Spreads the video budget (bytes) over the clip. Segments are aimed at an
+        even bitrate a little under the budget, leaving headroom for later edits.
+        Reused segments too far off that bitrate, like ones made for a clip of a
+        different length, are dropped from reused. Reused neighbours of the
+        segments which need encoding are dropped as well until those land close
+        to it, so edited edges don't stand out.
+        Returns the bitrate (kbps) for segments which need encoding
+        '''
+        def within(rate: float) -> bool:
+            return 1 / self.MAX_RATE_DIVERGENCE <= rate / target_rate <= self.MAX_RATE_DIVERGENCE
+
+        def segment_rate(span: tuple) -> float:
+            return cache.get(span)['size'] * 8 / (span[1] - span[0])
+
+        duration = (spans[-1][1] - spans[0][0]) / 1e3
+        target_rate = budget * (1 - self.SEGMENT_HEADROOM) * 8 / 1e3 / duration
+        for span in list(reused):
+            if not within(segment_rate(span)):
+                reused.discard(span)
+
+        while True:
+            new = {i for i, span in enumerate(spans) if span not in reused}
+            if not new:
+                return None
+
+            reused_size = sum(cache.get(span)['size'] for span in reused)
+            new_duration = sum(spans[i][1] - spans[i][0] for i in new) / 1e3
+            # fresh exports leave the headroom free, edits may use it up
+            fill = budget - reused_size if reused else budget * (1 - self.SEGMENT_HEADROOM)
+            encode_rate = fill * 8 / 1e3 / new_duration
+            if not reused or within(encode_rate):
+                return int(encode_rate)
+
+            neighbour = next(
+                span for i, span in enumerate(spans)
+                if span in reused and (i - 1 in new or i + 1 in new)
+            )
+            reused.discard(neighbour)
+
+    def _encode_segment(self, cache: SegmentCache, span: tuple, encode_rate: int) -> bool:
+        start, end = span
+        # independent mpegts segments carry their own headers and can be concatenated
+        segment_file = f'{start}-{end}-{encode_rate}.ts'
+        result = subprocess.run([
+            'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+            '-ss', f'{start / 1e3}',
+            '-to', f'{end / 1e3}',
+            '-i', f'{self.file}',
+            '-an', '-sn',
+            '-c:v', 'libx264',
+            '-fpsmax',  f'{self.fps}', '-s', f'{self.resolution}',
+            '-b:v', f'{encode_rate} K',
+            '-maxrate:v', f'{encode_rate} K',
+            '-f', 'mpegts',
+            f'{cache.path(segment_file)}',
+        ], creationflags=NO_WINDOW_FLAG)
+        if result.returncode != 0 or not os.path.isfile(cache.path(segment_file)):
+            return False
+
+        cache.put(span, segment_file, encode_rate)
+        return True
+
+    def _passthrough(self) -> bool:
+        '''
+        Stream copies the clip if the source codecs, resolution and fps are
+        already acceptable and the copied range is under the max filesize.
+        Returns whether the clip was saved
+        '''
+        probe = ffprobe(self.file)
+        streams = probe.get('streams', [])
+        video = video_stream(probe)
+        if video.get('codec_name') not in self.PASSTHROUGH_VIDEO_CODECS:
+            return False
+        for stream in streams:
+            if stream.get('codec_type') == 'audio' and \
+                    stream.get('codec_name') not in self.PASSTHROUGH_AUDIO_CODECS:
+                return False
+
+        width, height = map(int, self.resolution.split('x'))
+        if int(video.get('width', 0)) > width or int(video.get('height', 0)) > height:
+            return False
+        if frame_rate(video) > self.fps + 0.01:
+            return False
+
+        # copying has to start at a keyframe. the frames before the clip start
+        # are kept but hidden with an edit list, so they still count towards the size
+        start = strtoms(self.start) / 1e3
+        end = strtoms(self.end) / 1e3
+        keyframe = keyframe_before(self.file, start)
+        bitrate = float(probe.get('format', {}).get('bit_rate', 0))
+        if not bitrate or bitrate * (end - keyframe) / 8 > self.max_size_mb * 1e6:
+            return False
+
+        self.progress.emit(40)
+        result = subprocess.run([
+            'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+            '-ss', f'{self.start}',
+            '-to', f'{self.end}',
+            '-i', f'{self.file}',
+            # one audio track, like the re-encode path
+            '-map', '0:v:0', '-map', '0:a:0?',
+            '-c', 'copy',
+            '-f', 'mp4',
+            f'{self.out_file}',
+        ], creationflags=NO_WINDOW_FLAG)
+        if result.returncode != 0 or not os.path.isfile(self.out_file):
+            self._remove_output()
+            return False
+
+        # a copy which failed partway leaves a short clip behind
+        out_duration = float(ffprobe(self.out_file).get('format', {}).get('duration', 0))
+        if abs(out_duration - (end - start)) > self.PASSTHROUGH_DURATION_TOLERANCE:
+            self._remove_output()
+            return False
+
+        # the bitrate is an average, so the copied range may still be too big
+        if os.path.getsize(self.out_file) / 1e6 > self.max_size_mb:
+            self._remove_output()
+            return False
+        return True
+
+    def _remove_output(self):
+        try:
+            os.remove(self.out_file)
+        except OSError:
+            pass
+
+    def _stream_clip(self):
+        '''
+        Single pass fragmented MP4 encode, readable while it's being written.
+        Written bytes can't be taken back by re-encoding, so the bitrate is
+        picked to land well under the max filesize and ffmpeg's -fs only acts
+        as a hard stop. The output file may also be any ffmpeg output URL,
+        e.g. a tcp:// socket
+        '''
+        self.progress.emit(10)
+
+        duration = (strtoms(self.end) - strtoms(self.start)) / 1e3
+        max_bytes = self.max_size_mb * 1e6
+        # fragments are kept short enough that the headroom below works for short clips too
+        fragment_s = min(self.FRAGMENT_DURATION_US / 1e6, duration / 8)
+
+        # -fs can overshoot by the fragment being muxed when it triggers. with
+        # bufsize equal to maxrate, one fragment can hold up to twice the video
+        # rate, so the limit is max_bytes - (2 * video + audio) * fragment_s.
+        # the video rate is solved for so the expected size is a margin below that limit
+        kbps = 1e3 / 8
+        margin = self.STREAM_RATE_MARGIN
+        audio = self.audio_bitrate_kb
+        encode_rate = (margin * max_bytes - audio * kbps * (margin * fragment_s + duration)) / (
+            kbps * (duration + 2 * margin * fragment_s)
+        )
+        encode_rate = max(1, int(encode_rate))
+        size_limit = int(max_bytes - (2 * encode_rate + audio) * kbps * fragment_s)
+
+        result = subprocess.run([
+            'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+            '-progress', 'pipe:2',
+            '-ss', f'{self.start}',
+            '-to', f'{self.end}',
+            '-i', f'{self.file}',
+            '-c:v', 'libx264',
+            '-fpsmax',  f'{self.fps}', '-s', f'{self.resolution}',
+            '-b:v', f'{encode_rate} K',
+            '-maxrate:v', f'{encode_rate} K',
+            '-bufsize:v', f'{encode_rate} K',
+            '-b:a', f'{self.audio_bitrate_kb} K',
+            '-maxrate:a', f'{self.audio_bitrate_kb} K',
+            '-movflags', self.FRAGMENT_MOVFLAGS,
+            '-frag_duration', f'{int(fragment_s * 1e6)}',
+            '-fs', f'{size_limit}',
+            '-f', 'mp4',
+            f'{self.out_file}'
+        ], stderr=subprocess.PIPE, text=True, creationflags=NO_WINDOW_FLAG)
+
+        # -fs stops the encode silently, so check how much was actually written
+        out_time = 0
+        for line in result.stderr.splitlines():
+            key, _, value = line.partition('=')
+            if key == 'out_time_us' and value.strip().isdigit():
+                out_time = max(out_time, int(value) / 1e6)
+        if result.returncode != 0:
+            self.warning.emit('Saving the clip failed.')
+        elif out_time < duration - self.STREAM_DURATION_TOLERANCE:
+            self.warning.emit(
+                f'The clip hit the size limit and was cut short at {ftime(int(out_time * 1e3))}.'
+            )
+
+        self.progress.emit(100)
+        self.done.emit()
+
+    def _max_encode_rate(self) -> int:
+        '''
+        Video bitrate (kbps) which fills the max filesize over the whole clip
+        '''
+        duration = (strtoms(self.end) - strtoms(self.start)) / 1e3
+        max_encode_rate = ((self.max_size_mb * 8192) / duration)
+        max_encode_rate -= self.audio_bitrate_kb
+        return int(max_encode_rate)
+
+
+class PreviewWorker(SaveWorker):
+    '''
+    Quickly renders part of a clip at the bitrate a full save would use
+    '''
+    rendered = pyqtSignal(str)
+
+    def __init__(
+            self,
+            *args,
+            preview_start: str = None,
+            preview_end: str = None,
+            **kwargs,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.preview_start = preview_start or self.start
+        self.preview_end = preview_end or self.end
+
+    def render_preview(self):
+        self.progress.emit(10)
+
+        # bitrate is budgeted over the whole clip, even if only part is previewed
+        encode_rate = self._max_encode_rate()
+
+        # single ultrafast pass straight from the source
+        result = subprocess.run([
+            'ffmpeg', '-y', '-hide_banner', '-loglevel', 'error',
+            '-ss', f'{self.preview_start}',
+            '-to', f'{self.preview_end}',
+            '-i', f'{self.file}',
+            '-c:v', 'libx264', '-preset', 'ultrafast',
+            '-fpsmax',  f'{self.fps}', '-s', f'{self.resolution}',
+            '-b:v', f'{encode_rate} K',
+            '-maxrate:v', f'{encode_rate} K',
+            '-b:a', f'{self.audio_bitrate_kb} K',
+            '-maxrate:a', f'{self.audio_bitrate_kb} K',
+            f'{self.out_file}'
+        ], creationflags=NO_WINDOW_FLAG)
+
+        # only show previews that actually rendered
+        if result.returncode == 0 and os.path.getsize(self.out_file) > 0:
+            self.rendered.emit(self.out_file)
+        else:
+            try:
+                os.remove(self.out_file)
+            except OSError:
+                pass
+
+        self.progress.emit(100)
+        self.done.emit()